@@ -0,0 +1,8 @@
+import warnings
+
+import bson
+
+
+if not bson.has_c():
+    warnings.warn("The bson C extension is not available, so encoding and decoding mongoDB "
+                  "documents will use the much slower pure-Python implementation.")
@@ -1,47 +1,60 @@
-import json
+from concurrent.futures import ThreadPoolExecutor
+import functools
+import os
 
+import bson
+from bson import json_util
 from cf_units import Unit
 import dask.array as da
 import iris
 import iris.coord_systems
+from iris.fileformats.pp import STASH
 import numpy as np
 
-from .data_proxy import MongoDBDataProxy
+from ..data_proxy import MongoDBDataProxy, _decode_data
+
+
+@functools.lru_cache(maxsize=256)
+def _build_units(unit, calendar):
+    """Construct a unit, sharing the instance between identical units."""
+    if calendar is None:
+        result = Unit(unit)
+    else:
+        result = Unit(unit, calendar=calendar)
+    return result
+
+
+@functools.lru_cache(maxsize=256)
+def _build_coord_system(constructor, cs_items, ellipsoid_items, with_ellipsoid):
+    """
+    Construct a coord system from sorted tuples of its keyword arguments (and those of
+    its ellipsoid), sharing the instance between identical coord systems.
+
+    """
+    kwargs = dict(cs_items)
+    if with_ellipsoid:
+        ellipsoid = None if ellipsoid_items is None else iris.coord_systems.GeogCS(**dict(ellipsoid_items))
+        kwargs["ellipsoid"] = ellipsoid
+    return constructor(**kwargs)
 
 
 class CubeFromJSON(object):
     coord_systems_lookup = {'latitude_longitude': iris.coord_systems.GeogCS,
                             'rotated_latitude_longitude': iris.coord_systems.RotatedGeogCS,
                             'mercator': iris.coord_systems.Mercator}
+    # Converters for attributes not stored as their Iris value, keyed by attribute name.
+    # A STASH code may be stored under any of these names.
+    attr_handlers = dict.fromkeys(("stash", "STASH", "Stash"), lambda value: STASH(*value))
 
     def __init__(self, documents,
-                 host=None, port=None, db_name=None, collection_name=None):
+                 host=None, port=None, db_name=None, collection_name=None, max_workers=1):
         self.documents = documents
         self.host = host
         self.port = port
         self.db_name = db_name
         self.collection_name = collection_name
-
-    def _str_to_num(self, num_str):
-        try:
-            result = int(num_str)
-        except ValueError:
-            result = float(num_str)
-        return result
-
-    def _build_data(self, data_dict):
-        """Convert the data-containing dict back into a (possibly masked) NumPy array."""
-        data = data_dict["data"]
-        shape = data_dict["shape"]
-        dtype = np.dtype(data_dict["dtype"])
-        try:
-            mask = data_dict["mask"]
-            fill_value = self._str_to_num(data_dict["fill_value"])
-        except KeyError:
-            data = np.array(data)
-        else:
-            data = np.ma.masked_array(data, mask=mask, fill_value=fill_value)
-        return data.reshape(shape).astype(dtype)
+        # Number of threads used to load documents as cubes.
+        self.max_workers = max_workers
 
     def load_data(self, data_dict, obj_id):
         optionals = [self.host, self.port, self.db_name, self.collection_name, obj_id]
@@ -52,47 +65,52 @@ class CubeFromJSON(object):
                                          obj_id)
             data = da.from_array(lazy_data)
         else:
-            data = self._build_data(data_dict)
+            data = _decode_data(data_dict)
+            # Data decoded straight from the document's buffer is read-only, but cube data
+            # should be writable.
+            if not data.flags.writeable:
+                data = data.copy()
         return data
 
     def _build_units(self, units_dict):
-        if units_dict["calendar"] is None:
-            units = Unit(unit=units_dict["unit"])
-        else:
-            units = Unit(**units_dict)
-        return units
+        return _build_units(units_dict["unit"], units_dict["calendar"])
 
     def _build_coord_system(self, coord_system_dict):
         if coord_system_dict is None:
             result = None
         else:
-            cs_name = coord_system_dict.pop("name")
-            ellipsoid_kwargs = coord_system_dict.pop("ellipsoid", None)
-            if ellipsoid_kwargs is not None:
-                ellipsoid = iris.coord_systems.GeogCS(**ellipsoid_kwargs)
-            else:
-                ellipsoid = None
-
+            cs_name = coord_system_dict["name"]
             constructor = self.coord_systems_lookup.get(cs_name)
-            if constructor is not None:
-                if cs_name == "latitude_longitude":
-                    # GeogCS is defined with no ellipsoid.
-                    result = constructor(**coord_system_dict)
-                else:
-                    result = constructor(**coord_system_dict, ellipsoid=ellipsoid)
-            else:
-                raise ValueError(f"Coord system name {coord_system_name!r} is either not known or supported.")
+            if constructor is None:
+                raise ValueError(f"Coord system name {cs_name!r} is either not known or supported.")
+
+            cs_items = tuple(sorted((k, v) for (k, v) in coord_system_dict.items()
+                                    if k not in ("name", "ellipsoid")))
+            ellipsoid_kwargs = coord_system_dict.get("ellipsoid")
+            ellipsoid_items = None if ellipsoid_kwargs is None else tuple(sorted(ellipsoid_kwargs.items()))
+            # GeogCS is defined with no ellipsoid.
+            with_ellipsoid = cs_name != "latitude_longitude"
+            try:
+                result = _build_coord_system(constructor, cs_items, ellipsoid_items, with_ellipsoid)
+            except TypeError:
+                # Unhashable coord system values; construct without caching.
+                result = _build_coord_system.__wrapped__(constructor, cs_items, ellipsoid_items, with_ellipsoid)
         return result
 
     def _load_coord(self, coord, dim_coords=False):
         dims = coord["dims"]
         _CoordDefn = iris.coords.DimCoord if (dim_coords or dims=="scalar") else iris.coords.AuxCoord
 
-        points = np.array(coord["points"]).reshape(coord["shape"])
+        if "points" in coord:
+            points = np.array(coord["points"], dtype=coord.get("dtype")).reshape(coord["shape"])
+        else:
+            # Evenly spaced points are stored only as their first value, spacing and number.
+            points = coord["min"] + np.arange(coord["npoints"]) * coord["step"]
+            points = points.astype(coord.get("dtype", points.dtype))
         units = self._build_units(coord["units"])
         coord_system = self._build_coord_system(coord["coord_system"])
 
-        coord = _CoordDefn(coord["points"],
+        coord = _CoordDefn(points,
                            standard_name=coord["standard_name"],
                            long_name=coord["long_name"],
                            var_name=coord["var_name"],
@@ -120,17 +138,14 @@ class CubeFromJSON(object):
         return acad, scalar_coords
 
     def _build_attrs(self, attrs_dict):
-        """Parse the attributes dict, handling known special cases."""
-        parsed_attrs = {}
-        for key, value in attrs_dict.items():
-            # Handle special cases.
-            if key.lower() == "stash":
-                # Rebuild a STASH instance from the list that is stored.
-                parsed_attrs[key] = STASH(*value)
-            else:
-                # Everything else is transferred verbatim.
-                parsed_attrs[key] = value
-        return parsed_attrs
+        """
+        Parse the attributes dict, handling known special cases. A STASH instance is rebuilt
+        from the list that is stored; everything else is transferred verbatim.
+
+        """
+        handlers = self.attr_handlers
+        return {key: (handlers[key](value) if key in handlers else value)
+                for (key, value) in attrs_dict.items()}
 
     def _cell_methods(self, cell_methods):
         return CellMethod(cell_method_dict["method"],
@@ -165,25 +180,40 @@ class CubeFromJSON(object):
                 cube.add_cell_method(cell_method)
         return cube
 
+    def iter_cubes(self):
+        """Load documents queried from mongoDB as Iris cubes, yielding one cube at a time."""
+        for document in self.documents:
+            yield self.load_cube(document)
+
     def load(self):
         """Load documents queried from mongoDB as Iris cubes."""
-        cubes = []
-        for document in self.documents:
-            cube = self.load_cube(document)
-            cubes.append(cube)
+        # The documents may be a query cursor, so gather them to count them.
+        documents = list(self.documents)
+        n_workers = min(self.max_workers, len(documents))
+        if n_workers > 1:
+            # Decoding data arrays is done in NumPy, which releases the GIL.
+            with ThreadPoolExecutor(max_workers=n_workers) as executor:
+                cubes = iris.cube.CubeList(executor.map(self.load_cube, documents))
+        else:
+            cubes = iris.cube.CubeList(map(self.load_cube, documents))
         if len(cubes) == 1:
             return cubes[0]
         elif len(cubes) > 1:
-            return iris.cube.CubeList(cubes)
+            return cubes
         else:
             raise ValueError("No documents provided to load; nothing to do.")
 
     def fileopen(self):
         """
-        Open a JSON file at the path stored in `self.documents`
-        and construct a cube from the contents of the file.
+        Open a JSON (or BSON, if the extension is `.bson`) file at the path stored
+        in `self.documents` and construct a cube from the contents of the file.
 
         """
-        with open(self.documents, 'r') as ojfh:
-            cube_dict = json.load(ojfh)
-            return self.load_cube(cube_dict)
+        _, ext = os.path.splitext(self.documents)
+        if ext.lower() == ".bson":
+            with open(self.documents, 'rb') as obfh:
+                cube_dict = bson.decode(obfh.read())
+        else:
+            with open(self.documents, 'r') as ojfh:
+                cube_dict = json_util.loads(ojfh.read())
+        return self.load_cube(cube_dict)
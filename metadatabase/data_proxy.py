@@ -1,16 +1,148 @@
 """Provides a data proxy for deferring access to data from a mongoDB query."""
 
 
+from collections import OrderedDict
+import functools
+import itertools
+import threading
+
 from bson.objectid import ObjectId
 import numpy as np
 import pymongo
+import zstandard as zstd
+
+
+@functools.lru_cache(maxsize=None)
+def _get_client(host, port):
+    """
+    Return a mongoDB client for `host` and `port`, shared within this process.
+
+    Creating a client starts its own monitoring threads and opens new connections, so
+    reusing one avoids paying that cost on every chunk of data read.
+
+    """
+    return pymongo.MongoClient(host, port, maxPoolSize=200)
+
+
+@functools.lru_cache(maxsize=None)
+def _get_collection(host, port, db_name, collection_name):
+    """Return the (shared) collection handle for `collection_name` in database `db_name`."""
+    return _get_client(host, port)[db_name][collection_name]
+
+
+def _str_to_num(num_str):
+    """Convert a number expressed as a string to an int or a float."""
+    try:
+        result = int(num_str)
+    except ValueError:
+        result = float(num_str)
+    return result
+
+
+def _decompress(buf, codec):
+    """Decompress a binary payload that was compressed with `codec`."""
+    if codec is None:
+        result = buf
+    elif codec == "zstd":
+        # Payloads compressed in blocks don't record their size, so decompress as a stream.
+        result = zstd.ZstdDecompressor().decompressobj().decompress(buf)
+    else:
+        raise ValueError(f"Data compression codec {codec!r} is not supported.")
+    return result
+
+
+def _unpack_values(buf, dtype, stored_dtype=None):
+    """Unpack a buffer of array values, casting any stored at reduced precision back to `dtype`."""
+    if stored_dtype is None:
+        result = np.frombuffer(buf, dtype=dtype)
+    elif stored_dtype == "bfloat16":
+        # bfloat16 values are stored as the upper 16 bits of the equivalent float32 values.
+        bits = np.frombuffer(buf, dtype=np.uint16).astype(np.uint32) << 16
+        result = bits.view(np.float32).astype(dtype)
+    else:
+        result = np.frombuffer(buf, dtype=stored_dtype).astype(dtype)
+    return result
+
+
+def _decode_data(data_dict):
+    """Convert the data-containing dict of a document back into a (possibly masked) NumPy array."""
+    shape = data_dict["shape"]
+    dtype = np.dtype(data_dict["dtype"])
+    codec = data_dict.get("codec")
+    if isinstance(data_dict["data"], list):
+        # Older documents store the data and mask as nested lists.
+        data = np.asarray(data_dict["data"], dtype=dtype).reshape(shape)
+    else:
+        data = _unpack_values(_decompress(data_dict["data"], codec), dtype,
+                              data_dict.get("stored_dtype")).reshape(shape)
+    try:
+        mask = data_dict["mask"]
+        fill_value = data_dict["fill_value"]
+        if isinstance(fill_value, str):
+            # Older documents store the fill value as a string.
+            fill_value = _str_to_num(fill_value)
+    except KeyError:
+        pass
+    else:
+        if isinstance(mask, list):
+            mask = np.asarray(mask, dtype=bool)
+        else:
+            packed_mask = np.frombuffer(_decompress(mask, codec), dtype=np.uint8)
+            mask = np.unpackbits(packed_mask, count=data.size).view(bool)
+        data = np.ma.masked_array(data, mask=mask.reshape(shape), fill_value=fill_value)
+    return data
+
+
+class _DataCache(object):
+    """
+    A thread-safe store of decoded data arrays that evicts the least recently used arrays
+    to keep their total size within `max_nbytes`. Arrays larger than that are not stored.
+
+    """
+    def __init__(self, max_nbytes):
+        self.max_nbytes = max_nbytes
+        self.nbytes = 0
+        self._arrays = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _array_nbytes(self, array):
+        return array.nbytes + np.ma.getmask(array).nbytes
+
+    def get(self, key):
+        with self._lock:
+            result = self._arrays.get(key)
+            if result is not None:
+                self._arrays.move_to_end(key)
+        return result
+
+    def put(self, key, array):
+        nbytes = self._array_nbytes(array)
+        if nbytes <= self.max_nbytes:
+            with self._lock:
+                previous = self._arrays.pop(key, None)
+                if previous is not None:
+                    self.nbytes -= self._array_nbytes(previous)
+                self._arrays[key] = array
+                self.nbytes += nbytes
+                while self.nbytes > self.max_nbytes:
+                    _, evicted = self._arrays.popitem(last=False)
+                    self.nbytes -= self._array_nbytes(evicted)
+
+
+# Decoded data arrays, keyed by the proxy they were read for. Dask reads each chunk of a
+# proxy separately, so this avoids fetching and decoding the whole document again for every
+# chunk. Each proxy gets its own key, so a proxy made after its document has changed (such as
+# from a new query) never sees data decoded for an earlier proxy.
+_DATA_CACHE = _DataCache(max_nbytes=512 * 1024 ** 2)
+_PROXY_KEYS = itertools.count()
 
 
 # Inspired by https://github.com/SciTools/iris/blob/master/lib/iris/fileformats/netcdf.py#L418.
 class MongoDBDataProxy:
     """A proxy to the data of a single TileDB array attribute."""
 
-    __slots__ = ("shape", "dtype", "host", "port", "db_name", "collection_name", "obj_id")
+    __slots__ = ("shape", "dtype", "host", "port", "db_name", "collection_name", "obj_id",
+                 "_oid", "_key")
 
     def __init__(self, shape, dtype,
                  host, port, db_name, collection_name, obj_id):
@@ -21,44 +153,38 @@ class MongoDBDataProxy:
         self.db_name = db_name
         self.collection_name = collection_name
         self.obj_id = obj_id
+        # Parse the document ID once, rather than on every chunk read.
+        self._oid = obj_id if isinstance(obj_id, ObjectId) else ObjectId(obj_id)
+        self._key = next(_PROXY_KEYS)
 
     @property
     def ndim(self):
         return len(self.shape)
 
-    def _str_to_num(self, num_str):
-        """Convert a number expressed as a string to an int or a float."""
-        try:
-            result = int(num_str)
-        except ValueError:
-            result = float(num_str)
-        return result
+    def _fetch_data(self):
+        """
+        Fetch and decode the data array from mongoDB, or reuse the copy fetched by an earlier
+        read through this proxy if it has not since been evicted from the cache.
 
-    def _load_data(self, data_dict):
-        """Convert the data-containing dict back into a (possibly masked) NumPy array."""
-        data = data_dict["data"]
-        try:
-            mask = data_dict["mask"]
-            fill_value = self._str_to_num(data_dict["fill_value"])
-        except KeyError:
-            data = np.array(data)
-        else:
-            data = np.ma.masked_array(data, mask=mask, fill_value=fill_value)
-        return data.reshape(self.shape).astype(self.dtype)
+        """
+        data = _DATA_CACHE.get(self._key)
+        if data is None:
+            collection = _get_collection(self.host, self.port, self.db_name, self.collection_name)
+            # Only transfer the data, not the rest of the document's metadata.
+            document = collection.find_one({"_id": self._oid}, projection={"data": 1})
+            data = _decode_data(document["data"])
+            _DATA_CACHE.put(self._key, data)
+        return data
 
     def __getitem__(self, keys):
-        # Set up a client connection.
-        mdb_client = pymongo.MongoClient(self.host, self.port)
-        db = mdb_client[self.db_name]
-        collection = db[self.collection_name]
-
-        document = collection.find_one({"_id": ObjectId(self.obj_id)})
-        data = self._load_data(document)
+        data = self._fetch_data()
         return data[keys]
 
     def __getstate__(self):
-        return {attr: getattr(self, attr) for attr in self.__slots__}
+        return {attr: getattr(self, attr) for attr in self.__slots__ if not attr.startswith("_")}
 
     def __setstate__(self, state):
         for key, value in state.items():
-            setattr(self, key, value)
\ No newline at end of file
+            setattr(self, key, value)
+        self._oid = self.obj_id if isinstance(self.obj_id, ObjectId) else ObjectId(self.obj_id)
+        self._key = next(_PROXY_KEYS)
@@ -1,4 +1,51 @@
-import json
+import math
+
+import bson
+from bson import json_util
+import numpy as np
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+def _is_finite(obj):
+    """
+    Check that `obj` contains no NaN or infinite float values. Arrays are checked
+    vectorised, so convert them to lists only after checking them.
+
+    """
+    if isinstance(obj, (float, np.floating)):
+        result = math.isfinite(obj)
+    elif isinstance(obj, np.ndarray):
+        result = obj.dtype.kind not in "fc" or bool(np.isfinite(obj).all())
+    elif isinstance(obj, dict):
+        result = all(_is_finite(value) for value in obj.values())
+    elif isinstance(obj, (list, tuple)):
+        result = all(_is_finite(value) for value in obj)
+    else:
+        result = True
+    return result
+
+
+def _dumps(obj, finite=None):
+    """
+    Encode `obj` as mongoDB Extended JSON. orjson is used if it is installed, which also
+    encodes NumPy arrays and scalars natively; otherwise fall back to `bson.json_util`.
+
+    orjson encodes NaN and infinite values as null, so objects containing any are
+    always encoded by `bson.json_util`, which preserves them. `finite` says whether `obj`
+    is already known to contain none; if None, `obj` is checked here.
+
+    """
+    if finite is None:
+        finite = _is_finite(obj)
+    if orjson is not None and finite:
+        result = orjson.dumps(obj, default=json_util.default, option=orjson.OPT_SERIALIZE_NUMPY).decode()
+    else:
+        result = json_util.dumps(obj)
+    return result
 
 
 class _JSONiser(object):
@@ -6,6 +53,9 @@ class _JSONiser(object):
     def __init__(self, dataset):
         self.dataset = dataset
         self._content_dict = None
+        # Whether the content dict is known to contain no NaN or infinite float values,
+        # as recorded while it is populated; None if it has to be checked when encoded.
+        self._finite = None
 
     @property
     def content_dict(self):
@@ -47,11 +97,30 @@ class _JSONiser(object):
         """
         raise NotImplementedError
 
-    def save(self, filename):
-        """Save the dict representation of `self.dataset` as a JSON file."""
-        with open(filename, 'w') as ojfh:
-            json.dump(self.content_dict, ojfh)
+    def save(self, filename, format="json"):
+        """
+        Save the dict representation of `self.dataset` as a JSON file or, if `format` is
+        "bson", as a BSON file. Binary fields in JSON files are written in mongoDB Extended JSON.
+
+        Each top-level item of a JSON file is encoded and written in turn, so that the encoded
+        form of the whole dict is never held in memory alongside the dict itself.
+
+        """
+        if format == "bson":
+            # BSON stores numbers and binary fields as-is, with no text encoding.
+            with open(filename, 'wb') as obfh:
+                obfh.write(bson.encode(self.content_dict))
+        elif format == "json":
+            with open(filename, 'w') as ojfh:
+                ojfh.write("{")
+                for i, (key, value) in enumerate(self.content_dict.items()):
+                    if i:
+                        ojfh.write(", ")
+                    ojfh.write(f"{_dumps(key)}: {_dumps(value, finite=self._finite)}")
+                ojfh.write("}")
+        else:
+            raise ValueError(f"Save format must be one of 'json' or 'bson'; got {format!r}.")
 
     def dump_string(self):
         """Dump the cube dictionary as a JSON string."""
-        return json.dumps(self.content_dict)
\ No newline at end of file
+        return _dumps(self.content_dict, finite=self._finite)
\ No newline at end of file
@@ -1,69 +1,230 @@
 """Translate between Iris cubes and JSON objects."""
 
 
+from concurrent.futures import ThreadPoolExecutor
 import json
 import os
 
+from bson.binary import Binary
 from cf_units import Unit
 import dask.array as da
 import iris
 import iris.coord_systems
 import numpy as np
 from numpy.ma import is_masked
+import zstandard as zstd
 
-from .core import _JSONiser
+from .core import _JSONiser, _is_finite
 from ..data_proxy import MongoDBDataProxy
 
 
+_IRIS_API_VERSION = iris.__version__
+
+
 class CubeToJSON(_JSONiser):
-    def __init__(self, dataset, include_data=True, include_points=True):
+    # Largest finite magnitude representable at each reduced storage precision.
+    precision_limits = {"fp32": np.finfo(np.float32).max,
+                        "bf16": float.fromhex("0x1.fep127")}
+    # Approximate size of each block of lazy data computed at once when storing data.
+    block_nbytes = 64 * 1024 ** 2
+
+    def __init__(self, dataset, include_data=True, include_points=True, precision="exact", rtol=None):
         super().__init__(dataset)
         
         self.include_data = include_data
         self.include_points = include_points
+        self.precision = precision
+        self.rtol = rtol
 
         if not isinstance(self.dataset, iris.cube.Cube):
             raise TypeError(f"Expected a single cube, got {self.dataset.__class__.__name__!r} instead.")
-
-        self._api_version = iris.__version__
+        if self.precision != "exact" and self.precision not in self.precision_limits:
+            raise ValueError(f"Precision must be one of 'exact', 'fp32' or 'bf16'; got {self.precision!r}.")
 
     def _handle_units(self, unit):
         """Handle unit objects, time unit or otherwise."""
         return {"unit": str(unit),
                 "calendar": unit.calendar}
 
-    def _store_data(self, data):
-        """Store the cube's data array. XXX make this lazy!"""
-        data_dict = {}
-        if is_masked(data):
-            data_dict["data"] = data.data.tolist()
-            data_dict["mask"] = data.mask.tolist()
-            data_dict["fill_value"] = str(data.fill_value)
+    def _check_finite(self, values):
+        """
+        Record whether `values` contain NaN or infinite float values while the content dict
+        is being populated, so that the encoded dict need not be checked for them afterwards.
+
+        """
+        if self._finite:
+            self._finite = _is_finite(values)
+
+    def _to_bf16(self, values):
+        """Round float values to bfloat16, returned as the upper 16 bits of their float32 representation."""
+        values = values.astype(np.float32)
+        bits = values.view(np.uint32)
+        # Round to nearest, ties to even, keeping NaNs as NaNs.
+        rounded = (bits + (0x7FFF + ((bits >> 16) & 1))) >> 16
+        return np.where(np.isnan(values), 0x7FC0, rounded).astype(np.uint16)
+
+    def _storage_dtype(self, dtype):
+        """Return the name of the reduced dtype that values of `dtype` are stored as, or None."""
+        target_itemsize = 4 if self.precision == "fp32" else 2
+        if self.precision == "exact" or dtype.kind != "f" or dtype.itemsize <= target_itemsize:
+            result = None
+        else:
+            result = "float32" if self.precision == "fp32" else "bfloat16"
+        return result
+
+    def _downcast(self, values, stored_dtype):
+        """Convert float `values` to `stored_dtype`. Return them, and as float values again."""
+        if stored_dtype == "float32":
+            result = values.astype(np.float32)
+            restored = result
         else:
-            data_dict["data"] = data.tolist()
+            result = self._to_bf16(values)
+            restored = (result.astype(np.uint32) << 16).view(np.float32)
+        return result, restored
+
+    def _fits_precision(self, values, stored_dtype):
+        """
+        Check whether float `values` fit within the range of `stored_dtype` and, if `self.rtol`
+        is set, stay within that relative tolerance when stored as `stored_dtype`.
+
+        """
+        finite = values[np.isfinite(values)]
+        if finite.size and np.abs(finite).max() > self.precision_limits[self.precision]:
+            return False
+        if self.rtol is not None:
+            _, restored = self._downcast(values, stored_dtype)
+            return np.allclose(restored, values, rtol=self.rtol, atol=0, equal_nan=True)
+        return True
+
+    def _iter_blocks(self, data):
+        """
+        Yield successive pieces of `data` that concatenate in C order. Lazy data is computed
+        one block of up to `self.block_nbytes` at a time (or a single row of the innermost
+        dimension, if that is larger).
+
+        """
+        if not isinstance(data, da.Array):
+            yield data
+        elif data.ndim == 0:
+            yield data.compute()
+        else:
+            # Keep as many trailing dimensions whole as fit in a block, and split the dimension
+            # before them into runs of rows. Blocks then each cover a contiguous run of values.
+            split_dim = data.ndim - 1
+            row_nbytes = data.dtype.itemsize
+            while split_dim > 0 and row_nbytes * data.shape[split_dim] <= self.block_nbytes:
+                row_nbytes *= data.shape[split_dim]
+                split_dim -= 1
+            chunks = {dim: 1 for dim in range(split_dim)}
+            chunks[split_dim] = max(1, self.block_nbytes // max(1, row_nbytes))
+            chunks.update({dim: -1 for dim in range(split_dim + 1, data.ndim)})
+            data = data.rechunk(chunks)
+            for index in np.ndindex(*data.numblocks):
+                yield data.blocks[index].compute()
+
+    def _encode_blocks(self, data, stored_dtype=None):
+        """
+        Encode `data` one block at a time as zstd-compressed packed binary, with its mask
+        (if any) as packed bits. Return None if `stored_dtype` is set and any block's values
+        do not fit that reduced precision.
+
+        """
+        # Compression contexts are not thread-safe, so make them per call.
+        data_compressor = zstd.ZstdCompressor(level=3, threads=-1).compressobj()
+        mask_compressor = zstd.ZstdCompressor(level=3, threads=-1).compressobj()
+        data_frames = []
+        mask_frames = []
+        masked = False
+        fill_value = None
+        n_seen = 0
+        mask_remainder = np.zeros(0, dtype=bool)
+        for block in self._iter_blocks(data):
+            values = np.ma.getdata(block)
+            if stored_dtype is not None:
+                if not self._fits_precision(values, stored_dtype):
+                    return None
+                values, _ = self._downcast(values, stored_dtype)
+            data_frames.append(data_compressor.compress(values.tobytes(order="C")))
+
+            if not masked and is_masked(block):
+                # All values in preceding blocks were unmasked.
+                masked = True
+                fill_value = block.fill_value
+                mask_frames.append(mask_compressor.compress(bytes(n_seen // 8)))
+                mask_remainder = np.zeros(n_seen % 8, dtype=bool)
+            if masked:
+                # Mask bits that don't fill a whole byte are carried over to the next block.
+                bits = np.concatenate([mask_remainder, np.ma.getmaskarray(block).ravel()])
+                n_packed = bits.size - bits.size % 8
+                mask_frames.append(mask_compressor.compress(np.packbits(bits[:n_packed]).tobytes()))
+                mask_remainder = bits[n_packed:]
+            n_seen += block.size
+
+        data_dict = {"codec": "zstd"}
+        data_frames.append(data_compressor.flush())
+        data_dict["data"] = Binary(b"".join(data_frames))
+        if stored_dtype is not None:
+            # Values are cast back to `dtype` on load.
+            data_dict["stored_dtype"] = stored_dtype
+        if masked:
+            mask_frames.append(mask_compressor.compress(np.packbits(mask_remainder).tobytes()))
+            mask_frames.append(mask_compressor.flush())
+            data_dict["mask"] = Binary(b"".join(mask_frames))
+            data_dict["fill_value"] = fill_value.item()
+        return data_dict
+
+    def _store_data(self, data):
+        """
+        Store the cube's data array as packed binary, and its mask (if any) as packed bits.
+        Both are zstd-compressed. Lazy data is computed and compressed one block at a time,
+        so the whole array is never realised in memory.
+
+        """
+        data_dict = None
+        stored_dtype = self._storage_dtype(data.dtype)
+        if stored_dtype is not None:
+            # Each block is checked against the reduced precision as it is encoded, so lazy
+            # data is only computed again if some of its values turn out not to fit.
+            data_dict = self._encode_blocks(data, stored_dtype)
+        if data_dict is None:
+            data_dict = self._encode_blocks(data)
+        self._check_finite(data_dict.get("fill_value"))
         data_dict["shape"] = self.dataset.shape
         data_dict["dtype"] = str(self.dataset.dtype)
         return data_dict
 
     def _basic_attrs(self, d, obj):
         """
-        Add basic attributes of `obj` (a cube or a coord), such as names, units and cube attrs,
-        to a dictionary `d`.
+        Return a copy of the dictionary `d` with the basic attributes of `obj` (a cube or a coord),
+        such as names, units and cube attrs, added.
 
         """
-        # Names.
-        d["standard_name"] = obj.standard_name
-        d["long_name"] = obj.long_name
-        d["var_name"] = obj.var_name
-
-        # Units.
-        unit_dict = self._handle_units(obj.units)
-        d["units"] = unit_dict
-
-        # Object attributes (metadata).
-        d["attributes"] = obj.attributes
+        return {**d,
+                # Names.
+                "standard_name": obj.standard_name,
+                "long_name": obj.long_name,
+                "var_name": obj.var_name,
+                # Units.
+                "units": self._handle_units(obj.units),
+                # Object attributes (metadata).
+                "attributes": self._handle_attributes(obj.attributes)}
+
+    def _attr_value(self, value):
+        """Convert NumPy and tuple (such as STASH) attribute values to their native Python equivalents."""
+        if isinstance(value, np.generic):
+            result = value.item()
+        elif isinstance(value, np.ndarray):
+            result = value.tolist()
+        elif isinstance(value, tuple):
+            result = list(value)
+        else:
+            result = value
+        return result
 
-        return d
+    def _handle_attributes(self, attributes):
+        """Convert an Iris attributes dict to a plain dict with native values."""
+        self._check_finite(list(attributes.values()))
+        return {k: self._attr_value(v) for (k, v) in attributes.items()}
 
     def _get_coord_dims(self, coord, dim_coords=False):
         coord_dims = self.dataset.coord_dims(coord)
@@ -102,6 +263,22 @@ class CubeToJSON(_JSONiser):
                    "comments": ':,:'.join(cm.comments)}
         return cm_dict
 
+    def _regular_step(self, points):
+        """
+        Return the spacing between numeric 1D `points` if they are evenly spaced, such that
+        they can be rebuilt from their first value, spacing and number; otherwise None.
+
+        """
+        result = None
+        if points.ndim == 1 and points.size > 1 and points.dtype.kind in "iuf":
+            step = ((points[-1] - points[0]) / (points.size - 1)).item()
+            # Rebuild the points just as they are on load, and only treat them as evenly
+            # spaced if that reproduces them exactly.
+            regular = (points[0].item() + np.arange(points.size) * step).astype(points.dtype)
+            if np.array_equal(regular, points):
+                result = step
+        return result
+
     def coord_to_dict(self, coord, coord_dims, dim_coords=False):
         """
         Convert an Iris coord to a dictionary.
@@ -116,15 +293,19 @@ class CubeToJSON(_JSONiser):
             coord_dims, = coord_dims
         coord_dict["dims"] = coord_dims
 
-        # Store points metadata, and possibly points too.
-        coord_points = coord.points.tolist()
-        coord_dict["min"] = coord_points[0]
-        coord_dict["max"] = coord_points[-1]
-        coord_dict["step"] = None
-        coord_dict["npoints"] = len(coord_points)
-        coord_dict["shape"] = coord.points.shape
-        if self.include_points:
-            coord_dict["points"] = coord_points
+        # Store points metadata, and possibly points too. Only convert all the points
+        # to a list if they are actually being stored.
+        points = coord.points
+        self._check_finite(points)
+        coord_dict["min"] = points.flat[0].item()
+        coord_dict["max"] = points.flat[-1].item()
+        coord_dict["step"] = self._regular_step(points)
+        coord_dict["npoints"] = points.size
+        coord_dict["shape"] = points.shape
+        coord_dict["dtype"] = str(points.dtype)
+        # Evenly spaced points are rebuilt from min, step and npoints, so need not be stored.
+        if self.include_points and coord_dict["step"] is None:
+            coord_dict["points"] = points.tolist()
 
         # Circular coordinate?
 #         coord_dict["circular"] = coord.circular
@@ -135,6 +316,7 @@ class CubeToJSON(_JSONiser):
         # Handle coord system.
         cs = coord.coord_system
         coord_dict["coord_system"] = None if cs is None else self._cs_to_dict(cs)
+        self._check_finite(coord_dict["coord_system"])
 
         return coord_dict
 
@@ -143,22 +325,23 @@ class CubeToJSON(_JSONiser):
         Convert `self.dataset` to a dictionary, to save as JSON.
 
         XXX not currently handled:
-          * lazy data preservation.
-          * masked data.
           * aux factories
           * cell measures
           * ancillary variables.
 
         """
+        # Values are checked for NaNs and infinities as they are stored.
+        self._finite = True
+
         # Store top level cube attributes (names, units, global attrs etc.)
         self.content_dict = self._basic_attrs({}, self.dataset)
 
         # Record the API version.
-        self.content_dict["api_version"] = self._api_version
+        self.content_dict["api_version"] = _IRIS_API_VERSION
 
         if self.include_data:
-            # Store data. XXX this will realise data; a better solution would be to stream it.
-            data_dict = self._store_data(self.dataset.data)
+            # Store data, without realising lazy data.
+            data_dict = self._store_data(self.dataset.core_data())
             self.content_dict["data"] = data_dict
 
         # Store dimension coordinates.
@@ -193,11 +376,18 @@ class CubeToJSON(_JSONiser):
 
 
 class CubeMetaToJSON(object):
-    def __init__(self, dataset_ref):
+    def __init__(self, dataset_ref, max_workers=1):
         self.dataset_ref = dataset_ref
+        # Number of threads used to convert and save cubes. Only worth raising when this
+        # object isn't already one of many running in parallel (such as in a process pool).
+        self.max_workers = max_workers
 
         self._cubes = None
+        # Whether the cubes were loaded from `self.dataset_ref` by `iris.load`, so can be loaded again.
+        self._reloadable = False
         self._jsonisers = []
+        # The same for every cube loaded from the dataset.
+        self._mime_type = os.path.splitext(self.dataset_ref)[1][1:].lower()
 
     @property
     def cubes(self):
@@ -208,6 +398,7 @@ class CubeMetaToJSON(object):
     @cubes.setter
     def cubes(self, value):
         self._cubes = value
+        self._reloadable = False
 
     @property
     def content_dict(self):
@@ -215,6 +406,19 @@ class CubeMetaToJSON(object):
             self.populate_dict()
         return (jsoniser.content_dict for jsoniser in self._jsonisers)
 
+    def __getstate__(self):
+        # Cubes loaded by `iris.load` (and their metadata dicts) are loaded again from the
+        # dataset reference where needed, rather than being shipped along with this object.
+        # Cubes set directly or made by a custom loader can't be, so are pickled too.
+        state = {"dataset_ref": self.dataset_ref, "max_workers": self.max_workers}
+        if not self._reloadable:
+            state["cubes"] = self._cubes
+        return state
+
+    def __setstate__(self, state):
+        self.__init__(state["dataset_ref"], max_workers=state["max_workers"])
+        self._cubes = state.get("cubes")
+
     def _load(self, custom_load_fn=None):
         """
         Load the dataset specified by `self.dataset_ref` as one or more Iris cubes.
@@ -228,28 +432,49 @@ class CubeMetaToJSON(object):
             self.cubes = custom_load_fn(self.dataset_ref)
         else:
             self.cubes = iris.load(self.dataset_ref)
+            self._reloadable = True
+
+    def _jsonise_one(self, cube):
+        jsoniser = CubeToJSON(cube, include_data=False, include_points=False)
+        jsoniser.populate_dict()
+        jsoniser.content_dict["dataset_ref"] = self.dataset_ref
+        jsoniser.content_dict["mime_type"] = self._mime_type
+        return jsoniser
+
+    def _map(self, fn, *iterables):
+        """
+        Apply `fn` to the items of `iterables` (sequences of equal length), concurrently
+        on up to `self.max_workers` threads if there is more than one item.
+
+        """
+        n_workers = min(self.max_workers, len(iterables[0]))
+        if n_workers > 1:
+            with ThreadPoolExecutor(max_workers=n_workers) as executor:
+                result = list(executor.map(fn, *iterables))
+        else:
+            result = list(map(fn, *iterables))
+        return result
 
     def populate_dict(self):
-        for cube in self.cubes:
-            jsoniser = CubeToJSON(cube, include_data=False, include_points=False)
-            jsoniser.populate_dict()
-            jsoniser.content_dict["dataset_ref"] = self.dataset_ref
-            jsoniser.content_dict["mime_type"] = os.path.splitext(self.dataset_ref)[1][1:].lower()
-            self._jsonisers.append(jsoniser)
-
-    def _handle_filename(self, filename, idx):
-        with_index = len(self._jsonisers) > 1
+        # Each cube is converted independently of the others.
+        self._jsonisers = self._map(self._jsonise_one, self.cubes)
+
+    def _handle_filenames(self, filename, format="json"):
+        """Name the file each cube is saved to, numbering them if there is more than one cube."""
+        n_cubes = len(self._jsonisers)
         name, ext = os.path.splitext(filename)
         if not len(ext):
-            ext = ".json"
-        if with_index:
-            name = f"{name}_{idx}"
-        return f"{name}{ext}"
-
-    def save(self, filename):
-        for i, jsoniser in enumerate(self._jsonisers):
-            cube_filename = self._handle_filename(filename, i)
-            jsoniser.save(cube_filename)
+            ext = f".{format}"
+        if n_cubes > 1:
+            result = [f"{name}_{idx}{ext}" for idx in range(n_cubes)]
+        else:
+            result = [f"{name}{ext}"] * n_cubes
+        return result
+
+    def save(self, filename, format="json"):
+        cube_filenames = self._handle_filenames(filename, format=format)
+        self._map(lambda jsoniser, cube_filename: jsoniser.save(cube_filename, format=format),
+                  self._jsonisers, cube_filenames)
 
     def dump_string(self):
         return (jsoniser.dump_string() for jsoniser in self._jsonisers)
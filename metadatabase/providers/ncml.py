@@ -1,11 +1,21 @@
 import json
+import logging
 import os
+import subprocess
 import warnings
-import xml.etree.ElementTree as ET
+
+try:
+    # libxml2-backed parsing is much faster than the pure-Python fallback.
+    from lxml import etree as ET
+except ImportError:
+    import xml.etree.ElementTree as ET
 
 from .core import _JSONiser
 
 
+log = logging.getLogger(__name__)
+
+
 class NCMLtoJSON(_JSONiser):
     def __init__(self, dataset):
         super().__init__(dataset)
@@ -13,6 +23,7 @@ class NCMLtoJSON(_JSONiser):
         self._xml = None
         self._xmlns_attr = None
         self._dim_coords = None
+        self._dim_index = None
 
         warnings.warn(
             "NcML handling is incomplete. "
@@ -31,13 +42,16 @@ class NCMLtoJSON(_JSONiser):
 
     def _construct_xml(self):
         cmd = ["ncdump", "-x", self.dataset]
-        try:
-            result = subprocess.run(cmd, capture_output=True)
-            result.check_returncode()
-        except:
-            raise
-        else:
-            self.xml = ET.ElementTree(ET.fromstring(res.stdout.decode()))
+        # Parse the XML as ncdump writes it, rather than collecting all of its output first.
+        with subprocess.Popen(cmd, stdout=subprocess.PIPE) as proc:
+            try:
+                xml = ET.parse(proc.stdout)
+            finally:
+                # A failed ncdump writes no (or partial) XML, so report its failure over any parse error.
+                proc.stdout.close()
+                if proc.wait():
+                    raise subprocess.CalledProcessError(proc.returncode, cmd)
+        self.xml = xml
 
     def handle_dataset(self):
         _, filetype = os.path.splitext(self.dataset)
@@ -101,9 +115,9 @@ class NCMLtoJSON(_JSONiser):
             if dim_coords:
                 # Only ever 1D.
                 covered_dims, = covered_dims
-                coord_dims = self._dim_coords.index(covered_dims)
+                coord_dims = self._dim_index[covered_dims]
             else:
-                coord_dims = [self._dim_coords.index(d) for d in covered_dims]
+                coord_dims = [self._dim_index[d] for d in covered_dims]
         return coord_dims
 
     def coord_to_dict(self, var, dim_coords=False):
@@ -124,33 +138,38 @@ class NCMLtoJSON(_JSONiser):
             except ValueError:
                 self._xmlns_attr = ""
 
-        # Find dimensions.
+        # Gather the dimensions, variables and attributes in a single pass over the root's children.
         dims_tagname = self.construct_tag("dimension")
-        dims_childs = xml_root.findall(dims_tagname)
-        self._dim_coords = [child.attrib["name"] for child in dims_childs]
-        print(f"dimension names: {self._dim_coords}")
-
-        # Find variables.
         vars_tagname = self.construct_tag("variable")
-        vars_childs = xml_root.findall(vars_tagname)
+        attrs_tagname = self.construct_tag("attribute")
+        dimension_names = []
+        vars_childs = []
+        attrs_childs = []
+        for child in xml_root:
+            if child.tag == dims_tagname:
+                dimension_names.append(child.attrib["name"])
+            elif child.tag == vars_tagname:
+                vars_childs.append(child)
+            elif child.tag == attrs_tagname:
+                attrs_childs.append(child)
+        dimension_set = set(dimension_names)
+        log.debug("dimension names: %s", dimension_names)
 
         # The data variable is the variable not in the list of dimensions.
-        data_vars = []
-        for var in vars_childs:
-            if var.attrib["name"] not in dimension_names:
-                data_vars.append(var)
+        data_vars = [var for var in vars_childs if var.attrib["name"] not in dimension_set]
         data_var_names = [dv.attrib["name"] for dv in data_vars]
-        print(data_var_names)
+        log.debug("data variable names: %s", data_var_names)
 
         # Find dimension coordinates from the `shape` attribute of the data variable.
         covered_dims = []
         for data_var in data_vars:
-            print(data_var)
-            print(data_var.attrib["name"])
             dim_names = data_var.attrib["shape"].split(" ")
             covered_dims.extend(dim_names)
-        self._dim_coords = list(set(covered_dims))
-        other_coord_names = list(set(dimension_names) - set(self._dim_coords) - set(data_var_names))
+        # Keep the dimensions in order of first appearance, so that each one's index is deterministic.
+        self._dim_coords = list(dict.fromkeys(covered_dims))
+        self._dim_index = {name: i for i, name in enumerate(self._dim_coords)}
+        dim_coord_set = set(self._dim_coords)
+        other_coord_set = dimension_set - dim_coord_set - set(data_var_names)
 
         # Handle core metadata.
         base_dict = {"mime_type": "nc",
@@ -162,10 +181,10 @@ class NCMLtoJSON(_JSONiser):
         aux_coords_dict = {}
         for var in vars_childs:
             child_var_name = var.attrib["name"]
-            if child_var_name in dim_coord_names:
+            if child_var_name in dim_coord_set:
                 dim_coord_dict = self.coord_to_dict(var, dim_coords=True)
                 dim_coords_dict[child_var_name] = dim_coord_dict
-            elif child_var_name in other_coord_names:
+            elif child_var_name in other_coord_set:
                 aux_coord_dict = self.coord_to_dict(var, dim_coords=False)
                 aux_coords_dict[child_var_name] = aux_coord_dict
             else:
@@ -176,13 +195,10 @@ class NCMLtoJSON(_JSONiser):
         self.content_dict["dim_coords"] = dim_coords_dict
 
         # Add other coordinates if there are any.
-        if len(other_coord_names):
+        if len(other_coord_set):
             self.content_dict["aux_coords"] = aux_coords_dict
 
         # Handle attributes.
-        attrs_tagname = self.construct_tag("attribute")
-        attrs_childs = xml_root.findall(attrs_tagname)
-
         attrs_dict = {}
         for attr in attrs_childs:
             name = attr.attrib["name"]
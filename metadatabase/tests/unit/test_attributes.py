@@ -0,0 +1,22 @@
+"""Test converting cube attributes to their stored dict representation."""
+
+import iris.cube
+import numpy as np
+
+from metadatabase.providers.iris import CubeToJSON
+
+
+def test_native_values():
+    cube = iris.cube.Cube(np.zeros(2), attributes={"a": np.float32(1.5), "b": np.arange(3), "c": (1, 2)})
+    attributes = CubeToJSON(cube).content_dict["attributes"]
+    assert attributes == {"a": 1.5, "b": [0, 1, 2], "c": [1, 2]}
+    assert type(attributes["a"]) is float
+
+
+def test_changed_attributes_converted_again():
+    cube = iris.cube.Cube(np.zeros(2), attributes={"a": 1})
+    jsoniser = CubeToJSON(cube)
+    assert jsoniser.content_dict["attributes"] == {"a": 1}
+    cube.attributes["a"] = 2
+    jsoniser.populate_dict()
+    assert jsoniser.content_dict["attributes"] == {"a": 2}
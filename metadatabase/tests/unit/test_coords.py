@@ -0,0 +1,64 @@
+"""Test round-tripping cube coords through their stored dict representation."""
+
+from bson import json_util
+import iris.coords
+import iris.cube
+import numpy as np
+import pytest
+
+from metadatabase.consumers.iris import CubeFromJSON
+from metadatabase.providers.iris import CubeToJSON
+
+
+def roundtrip_coord(points):
+    """Store a cube with a single dim coord of `points` and load it back again."""
+    cube = iris.cube.Cube(np.zeros(len(points)), long_name="thingness")
+    cube.add_dim_coord(iris.coords.DimCoord(points, long_name="wibble", units="1"), 0)
+    cube_dict = CubeToJSON(cube).content_dict
+    coord_dict = cube_dict["dim_coords"]["wibble"]
+    loaded = CubeFromJSON([cube_dict]).load_cube(cube_dict)
+    return coord_dict, loaded.coord("wibble").points
+
+
+@pytest.mark.parametrize("points", [
+    np.linspace(-4, 4, 9),
+    np.linspace(394200, 394236, 7),
+    np.arange(-180, 180, 90),
+    np.arange(10, dtype=np.float32) * np.float32(0.5),
+])
+def test_regular_points_stored_as_step(points):
+    coord_dict, loaded = roundtrip_coord(points)
+    assert coord_dict["step"] is not None
+    assert "points" not in coord_dict
+    assert loaded.dtype == points.dtype
+    np.testing.assert_array_equal(loaded, points)
+
+
+@pytest.mark.parametrize("points", [
+    np.array([394200, 394206, 394212.5, 394218]),
+    np.array([0.0, 1.0, 2.0 + 1e-12, 3.0]),
+    np.array([1, 2, 5], dtype=np.int32),
+])
+def test_irregular_points_stored_in_full(points):
+    coord_dict, loaded = roundtrip_coord(points)
+    assert coord_dict["step"] is None
+    assert coord_dict["points"] == points.tolist()
+    assert loaded.dtype == points.dtype
+    np.testing.assert_array_equal(loaded, points)
+
+
+
+@pytest.mark.parametrize("points", [
+    np.array([0.0, 1.5, 2.0]),
+    np.array([0.0, np.nan, 2.0]),
+    np.array([0.0, np.inf, 2.0]),
+])
+def test_points_json_roundtrip(points):
+    cube = iris.cube.Cube(np.zeros(len(points)), long_name="thingness")
+    cube.add_aux_coord(iris.coords.AuxCoord(points, long_name="wibble", units="1"), 0)
+    jsoniser = CubeToJSON(cube)
+    cube_dict = json_util.loads(jsoniser.dump_string())
+    # Non-finite points are noted as they are stored, rather than by checking the encoded dict.
+    assert jsoniser._finite == bool(np.isfinite(points).all())
+    loaded = CubeFromJSON([cube_dict]).load_cube(cube_dict)
+    np.testing.assert_array_equal(loaded.coord("wibble").points, points)
@@ -0,0 +1,37 @@
+"""Test pickling the converter for a dataset's cube metadata."""
+
+import pickle
+
+import iris.cube
+from iris.cube import CubeList
+import numpy as np
+
+from metadatabase.providers.iris import CubeMetaToJSON
+
+
+def make_cubes(dataset_ref):
+    return CubeList([iris.cube.Cube(np.zeros(2), long_name="thingness")])
+
+
+def test_custom_loaded_cubes_pickled():
+    meta = CubeMetaToJSON("s3://bucket/thing.nc")
+    meta._load(custom_load_fn=make_cubes)
+    unpickled = pickle.loads(pickle.dumps(meta))
+    assert unpickled.cubes == make_cubes(meta.dataset_ref)
+    assert [d["long_name"] for d in unpickled.content_dict] == ["thingness"]
+
+
+def test_set_cubes_pickled():
+    meta = CubeMetaToJSON("thing.nc")
+    meta.cubes = make_cubes(meta.dataset_ref)
+    assert pickle.loads(pickle.dumps(meta)).cubes == meta.cubes
+
+
+def test_iris_loaded_cubes_not_pickled(monkeypatch):
+    monkeypatch.setattr(iris, "load", make_cubes)
+    meta = CubeMetaToJSON("thing.nc")
+    meta._load()
+    assert "cubes" not in meta.__getstate__()
+    unpickled = pickle.loads(pickle.dumps(meta))
+    assert unpickled._cubes is None
+    assert unpickled.cubes == meta.cubes
@@ -0,0 +1,200 @@
+"""Test encoding cube data to its stored form and decoding it again."""
+
+from bson.binary import Binary
+import dask.array as da
+import iris.cube
+import numpy as np
+import numpy.ma as ma
+import pytest
+
+from metadatabase.consumers.iris import CubeFromJSON
+from metadatabase.data_proxy import _decode_data
+from metadatabase.providers.iris import CubeToJSON
+
+
+def store(data, block_nbytes=None, **kwargs):
+    """Return the stored data dict for a cube of `data`."""
+    jsoniser = CubeToJSON(iris.cube.Cube(data, long_name="thingness"), **kwargs)
+    if block_nbytes is not None:
+        jsoniser.block_nbytes = block_nbytes
+    return jsoniser.content_dict["data"]
+
+
+def assert_masked_equal(result, expected):
+    assert result.dtype == expected.dtype
+    assert result.shape == expected.shape
+    np.testing.assert_array_equal(ma.getmaskarray(result), ma.getmaskarray(expected))
+    np.testing.assert_array_equal(ma.getdata(result)[~ma.getmaskarray(expected)],
+                                  ma.getdata(expected)[~ma.getmaskarray(expected)])
+
+
+@pytest.mark.parametrize("data", [
+    np.arange(24, dtype=np.int32).reshape(2, 3, 4),
+    np.linspace(0, 1, 35).reshape(7, 5),
+    np.float64(1.5),
+])
+def test_exact(data):
+    data_dict = store(data)
+    assert data_dict["codec"] == "zstd"
+    assert isinstance(data_dict["data"], Binary)
+    assert "stored_dtype" not in data_dict
+    assert "mask" not in data_dict
+    result = _decode_data(data_dict)
+    assert not ma.isMaskedArray(result)
+    assert result.dtype == data.dtype
+    np.testing.assert_array_equal(result, data)
+
+
+def test_lazy_multiple_blocks():
+    data = np.random.default_rng(0).random((13, 5, 3))
+    # Blocks of 16 values, so that blocks split the innermost rows.
+    data_dict = store(da.from_array(data, chunks=(4, 2, 3)), block_nbytes=16 * data.itemsize)
+    np.testing.assert_array_equal(_decode_data(data_dict), data)
+
+
+def test_lazy_data_not_realised():
+    data = da.zeros((40, 50), chunks=(10, 50))
+    cube = iris.cube.Cube(data)
+    jsoniser = CubeToJSON(cube)
+    jsoniser.block_nbytes = 50 * data.dtype.itemsize
+    iter_blocks = jsoniser._iter_blocks
+    block_sizes = []
+
+    def record_blocks(data):
+        for block in iter_blocks(data):
+            block_sizes.append(block.nbytes)
+            yield block
+
+    jsoniser._iter_blocks = record_blocks
+    data_dict = jsoniser.content_dict["data"]
+    assert cube.has_lazy_data()
+    assert len(block_sizes) == 40
+    assert max(block_sizes) <= jsoniser.block_nbytes
+    np.testing.assert_array_equal(_decode_data(data_dict), np.zeros((40, 50)))
+
+
+def test_masked():
+    data = ma.masked_less(np.arange(35, dtype=np.int32).reshape(7, 5), 9)
+    data.fill_value = -999
+    data_dict = store(data)
+    result = _decode_data(data_dict)
+    assert_masked_equal(result, data)
+    assert result.fill_value == -999
+    assert isinstance(data_dict["fill_value"], int)
+
+
+def test_lazy_mask_starts_in_later_block():
+    values = np.arange(13 * 5, dtype=np.float64).reshape(13, 5)
+    # Only values in the last few rows are masked, and blocks hold 3 values so that
+    # the mask bits of each block don't fill a whole number of bytes.
+    data = ma.masked_greater(values, 55)
+    lazy = da.ma.masked_greater(da.from_array(values, chunks=(2, 5)), 55)
+    result = _decode_data(store(lazy, block_nbytes=3 * values.itemsize))
+    assert_masked_equal(result, data)
+
+
+def test_nan_fill_value():
+    data = ma.masked_array([1.0, 2.0, 3.0], mask=[0, 1, 0], fill_value=np.nan)
+    result = _decode_data(store(data))
+    assert_masked_equal(result, data)
+    assert np.isnan(result.fill_value)
+
+
+@pytest.mark.parametrize("precision, stored_dtype, rtol", [
+    ("fp32", "float32", 2 ** -24),
+    ("bf16", "bfloat16", 2 ** -8),
+])
+@pytest.mark.parametrize("lazy", [False, True])
+def test_reduced_precision(precision, stored_dtype, rtol, lazy):
+    values = np.random.default_rng(1).normal(size=(9, 4)) * 1e3
+    values[2, 1] = np.nan
+    data = ma.masked_array(values, mask=values < -1e3)
+    if lazy:
+        data = da.ma.masked_array(da.from_array(values, chunks=(2, 4)), mask=values < -1e3)
+    data_dict = store(data, block_nbytes=6 * values.itemsize, precision=precision)
+    assert data_dict["stored_dtype"] == stored_dtype
+    result = _decode_data(data_dict)
+    assert result.dtype == np.float64
+    np.testing.assert_array_equal(ma.getmaskarray(result), values < -1e3)
+    np.testing.assert_allclose(ma.getdata(result), values, rtol=rtol, equal_nan=True)
+
+
+@pytest.mark.parametrize("lazy", [False, True])
+def test_reduced_precision_out_of_range_stored_exactly(lazy):
+    values = np.array([[1.0, 2.0], [3.0, 1e300]])
+    data = da.from_array(values, chunks=1) if lazy else values
+    data_dict = store(data, block_nbytes=values.itemsize, precision="bf16")
+    assert "stored_dtype" not in data_dict
+    np.testing.assert_array_equal(_decode_data(data_dict), values)
+
+
+def test_reduced_precision_outside_rtol_stored_exactly():
+    values = np.array([1.0, 1.0 + 2 ** -30])
+    data_dict = store(values, precision="fp32", rtol=1e-12)
+    assert "stored_dtype" not in data_dict
+    np.testing.assert_array_equal(_decode_data(data_dict), values)
+
+
+def test_reduced_precision_leaves_integers_exact():
+    values = np.arange(6, dtype=np.int64)
+    data_dict = store(values, precision="bf16")
+    assert "stored_dtype" not in data_dict
+    np.testing.assert_array_equal(_decode_data(data_dict), values)
+
+
+def test_uncompressed():
+    # Documents stored without a codec hold uncompressed packed binary.
+    data = ma.masked_less(np.arange(10, dtype=np.int16), 3)
+    data_dict = {"data": Binary(data.data.tobytes()),
+                 "mask": Binary(np.packbits(data.mask).tobytes()),
+                 "fill_value": 7,
+                 "shape": [10],
+                 "dtype": "int16"}
+    result = _decode_data(data_dict)
+    assert_masked_equal(result, data)
+    assert result.fill_value == 7
+
+
+def test_legacy_lists():
+    data_dict = {"data": [[1, 2], [3, 4]],
+                 "mask": [[False, True], [False, False]],
+                 "fill_value": "-999",
+                 "shape": [2, 2],
+                 "dtype": "int32"}
+    result = _decode_data(data_dict)
+    assert_masked_equal(result, ma.masked_array(np.array([[1, 2], [3, 4]], dtype=np.int32),
+                                                mask=[[0, 1], [0, 0]]))
+    assert result.fill_value == -999
+
+
+def test_unknown_codec():
+    data_dict = store(np.arange(3))
+    data_dict["codec"] = "lz4"
+    with pytest.raises(ValueError):
+        _decode_data(data_dict)
+
+
+@pytest.mark.parametrize("format", ["json", "bson"])
+def test_save_and_load_file(tmp_path, format):
+    data = ma.masked_array(np.linspace(0, 1, 12).reshape(3, 4), mask=np.eye(3, 4), fill_value=np.nan)
+    cube = iris.cube.Cube(data, long_name="thingness", units="K", attributes={"source": "test"})
+    filename = str(tmp_path / f"cube.{format}")
+    CubeToJSON(cube, precision="fp32").save(filename, format=format)
+    loaded = CubeFromJSON(filename).fileopen()
+    assert_masked_equal(loaded.data, data.astype(np.float32).astype(np.float64))
+    assert np.isnan(loaded.data.fill_value)
+    assert loaded.attributes == {"source": "test"}
+
+
+@pytest.mark.parametrize("data", [
+    np.arange(12, dtype=np.int32).reshape(3, 4),
+    ma.masked_less(np.arange(12, dtype=np.int32).reshape(3, 4), 5),
+])
+def test_loaded_data_writable(data):
+    cube = iris.cube.Cube(data, long_name="thingness")
+    cube_dict = CubeToJSON(cube).content_dict
+    loaded = CubeFromJSON([cube_dict]).load_cube(cube_dict)
+    assert loaded.data.flags.writeable
+    loaded.data[0, 0] = 5
+    loaded.data += 1
+    assert loaded.data[0, 0] == 6